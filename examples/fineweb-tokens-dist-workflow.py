@@ -1,13 +1,58 @@
 from datatrove.executor.base import PipelineExecutor
 from datatrove.executor.local import LocalPipelineExecutor
 from datatrove.executor.slurm import SlurmPipelineExecutor
+from datatrove.io import get_datafolder
 from datatrove.pipeline.readers import JsonlReader, ParquetReader
+from datatrove.pipeline.tokens.distributed_megatron_merger import DistTokenizerMergerExecutor, DistTokenizerMergerPlanner
 from datatrove.pipeline.tokens.megatron_tokenizer import MegatronTokenizer
 from datatrove.pipeline.tokens.megatron_merger import MegatronTokenizerMerger
 
 
-def process(input_folder, output_folder, filename, job_name, tokenizer, njobs=100):
+TOKEN_BYTES_PER_INPUT_BYTE = 3  # rough size of the tokens written for each byte of (compressed) parquet input
+
+
+def get_input_bytes(input_folder, glob_pattern="*.parquet"):
+    """ Total size of the input files.
+    """
+    input_folder = get_datafolder(input_folder)
+    return sum(input_folder.size(file) for file in input_folder.list_files(glob_pattern=glob_pattern))
+
+
+def get_njobs(input_bytes, input_bytes_per_task):
+    """ Number of tokenization tasks so that each one reads about input_bytes_per_task of (compressed) input files.
+    """
+    return max(1, -(-input_bytes // input_bytes_per_task))  # round up, so tasks read at most about input_bytes_per_task
+
+
+def get_merge_njobs(input_bytes, output_shard_size_bytes):
+    """ Expected number of merge buckets planned, one merge task per output shard.
+    """
+    return max(1, -(-input_bytes * TOKEN_BYTES_PER_INPUT_BYTE // output_shard_size_bytes))
+
+
+def process(
+    input_folder,
+    output_folder,
+    filename,
+    job_name,
+    tokenizer,
+    njobs=None,
+    # parquet input read by each tokenization task, each task writes ~TOKEN_BYTES_PER_INPUT_BYTE as many bytes of
+    # (intermediate) tokens
+    input_bytes_per_task=2 * 1024**3,
+    # size of the final merged token files: few large files are much lighter on (Lustre) metadata servers
+    output_shard_size_bytes=22 * 1024**3,
+    token_size=4,
+    batch_size=1024,
+    # plan and merge in a single task (one less queue wait). All merge buckets then run serially in that one task:
+    # only for small datasets whose whole merge fits in a single task's time limit
+    fused=False,
+    ):
     merge = True
+    input_bytes = get_input_bytes(input_folder)
+    if njobs is None:
+        njobs = get_njobs(input_bytes, input_bytes_per_task)
+    merge_njobs = get_merge_njobs(input_bytes, output_shard_size_bytes)
     pipeline_1 = [
         ParquetReader(
              input_folder,
@@ -19,7 +64,8 @@ def process(input_folder, output_folder, filename, job_name, tokenizer, njobs=10
             local_working_dir=f"{output_folder}/scratch/",
             save_filename=f"{filename}",
             tokenizer_name_or_path=f"{tokenizer}",
-            batch_size=8,
+            token_size=token_size,
+            batch_size=batch_size,
             shuffle=not merge,
         ),
     ]
@@ -30,6 +76,7 @@ def process(input_folder, output_folder, filename, job_name, tokenizer, njobs=10
             output_folder=f"{output_folder}/dmerge-test/",
             plan_folder=f"{output_folder}/dmerge-plan/",
             save_filename=f"{filename}",
+            max_tokens_per_file=output_shard_size_bytes // token_size,
         ),
     ]
 
@@ -58,6 +105,25 @@ def process(input_folder, output_folder, filename, job_name, tokenizer, njobs=10
         )
 
 
+    if merge and fused:
+        # planning is a single task anyway: run the merge right after it in the same job
+        executor_3: PipelineExecutor = SlurmPipelineExecutor(
+            pipeline=pipeline_2 + pipeline_3,
+            cpus_per_task=4,
+            mem_per_cpu_gb=12,
+            job_name=f"{job_name}-merge",
+            partition="debug",
+            time="12:00:00",
+            env_command="module load conda/23.07 && conda activate py3",
+            logging_dir="log_dir/merge",
+            workers=1,
+            tasks=1,
+            depends=executor_1,
+            )
+        print(executor_3.run())
+        return
+
+
     executor_2: PipelineExecutor = SlurmPipelineExecutor(
         pipeline=pipeline_2,
         cpus_per_task=4,
@@ -82,8 +148,8 @@ def process(input_folder, output_folder, filename, job_name, tokenizer, njobs=10
         time="12:00:00",
         env_command="module load conda/23.07 && conda activate py3",
         logging_dir=f"log_dir/execute",
-        workers=njobs,
-        tasks=bjobs,
+        workers=merge_njobs,
+        tasks=merge_njobs,
         depends=executor_2,
         )
 
@@ -105,5 +171,4 @@ if __name__ == "__main__":
         filename=PART,
         job_name=f"FW-{PART}",
         tokenizer=TOKENIZER_DIR,
-        njobs=200,
         )
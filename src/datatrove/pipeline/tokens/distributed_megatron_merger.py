@@ -211,6 +211,9 @@ class DistTokenizerMergerExecutor(DistTokenizerMergerPlanner):
                 The total number of processes
         """
         files_shard = self.plan_folder.get_shard(rank, world_size, recursive=self.recursive, glob_pattern="plan_bucket*.dat")
+        if not files_shard:
+            logger.warning(f"No plan buckets to merge for {rank=}.")
+            return
         extra_args = pickle.load(self.plan_folder.open("plan_common.dat", mode="rb"))
         for file in files_shard:
             args = pickle.load(self.plan_folder.open(file, mode="rb"))
@@ -1,4 +1,5 @@
 from tqdm import tqdm
+import itertools
 import struct
 import logging
 from enum import Enum, StrEnum
@@ -234,6 +235,28 @@ class TokenizedFile:
         self.write_bytes(struct.pack(f"<%s{self.token_format}" % len(tokens), *tokens))
         self.doc_indices.append(index) 
 
+    def write_batch(self, batch_tokens: list[list[int]], indices: list[int]):
+        """Write the tokens of several documents at once, with a single (large) write to the tokens file.
+
+        Args:
+            batch_tokens (list[list[int]]): the tokens of each document
+            indices (list[int]): the index of each document
+        """
+        doc_lengths = np.fromiter(map(len, batch_tokens), dtype=np.int64, count=len(batch_tokens))
+        tokens = np.fromiter(
+            itertools.chain.from_iterable(batch_tokens), dtype=np.int64, count=int(doc_lengths.sum())
+        )
+        # casting would silently wrap token ids that do not fit in token_size bytes
+        if len(tokens) and (tokens.min() < 0 or tokens.max() > np.iinfo(self.token_dtype).max):
+            raise ValueError(
+                f"Token ids must be between 0 and {np.iinfo(self.token_dtype).max} to be saved with "
+                f"{self.token_size=}, got ids between {tokens.min()} and {tokens.max()}. "
+                f"Use a larger token_size for this tokenizer."
+            )
+        tokens = tokens.astype(np.dtype(self.token_dtype).newbyteorder("<"))
+        self.write_bytes(tokens.tobytes(), doc_ends=np.cumsum(doc_lengths).tolist())
+        self.doc_indices.extend(indices)
+
     def copy(
         self,
         save_filename: str,
@@ -447,40 +470,9 @@ class MegatronTokenizer(PipelineStepWithTokenizer):
         for batch in tqdm(batched(data, self.batch_size), desc="Writing unshuffled documents", unit="batches"):
             with self.track_time(unit="batch"):
                 encoded_batch: list[Encoding] = encode_batch(self.tokenizer, [document.text for document in batch])
-                for document, tokens in zip(batch, encoded_batch):
-                    # write bytes to disk
-                    unshuff.write(tokens, inc.next())
-                    # save stats
-                    self.stat_update("tokens", value=len(tokens))
-        unshuff.close()
-        return unshuff
-
-    def write_unshuffled(self, data: DocumentsPipeline, filename: str, rank: int = 0, world_size: int = 1):
-        """Tokenize documents with the tokenizer in batches and write the unshuffled tokenized documents to a file.
-
-        Args:
-            data (DocumentsPipeline): the documents to process
-            filename (str): the filename to use for the output file
-        """
-        from tokenizers import Encoding
-
-        unshuff = TokenizedFile(
-            self.output_folder if not self.shuffle or not self.local_working_dir else self.local_working_dir,
-            filename,
-            save_index=not self.shuffle,
-            upload_block_size=self.upload_block_size,
-            tokenizer_name_or_path=self.tokenizer_name_or_path,
-            save_final_metadata=self.save_final_metadata,
-            token_size=self.token_size,
-        )
-        inc = Incrementer(rank, world_size)
-        # tokenize document's text in batches to go faster
-        for batch in tqdm(batched(data, self.batch_size), desc="Writing unshuffled documents", unit="batches"):
-            with self.track_time(unit="batch"):
-                encoded_batch: list[Encoding] = encode_batch(self.tokenizer, [document.text for document in batch])
-                for document, tokens in zip(batch, encoded_batch):
-                    # write bytes to disk
-                    unshuff.write(tokens, inc.next())
+                # write the whole batch to disk at once
+                unshuff.write_batch(encoded_batch, [inc.next() for _ in encoded_batch])
+                for tokens in encoded_batch:
                     # save stats
                     self.stat_update("tokens", value=len(tokens))
         unshuff.close()
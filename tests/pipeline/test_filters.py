@@ -1,7 +1,13 @@
+import os
+import shutil
+import tempfile
 import unittest
 
+import numpy as np
+
 from datatrove.data import Document
 from datatrove.pipeline.filters import (
+    FastTextClassifierFilter,
     GopherQualityFilter,
     GopherRepetitionFilter,
     LambdaFilter,
@@ -10,6 +16,7 @@ from datatrove.pipeline.filters import (
     UnigramLogProbFilter,
     URLFilter,
 )
+from datatrove.utils.text import SPLIT_TEXT_PARAGRAPHS, SPLIT_TEXT_SENTENCES
 
 from ..utils import require_fasttext, require_nltk, require_tldextract
 
@@ -130,3 +137,126 @@ class TestFilters(unittest.TestCase):
                 assert url_filter.filter(doc)
             else:
                 self.check_filter(url_filter, doc, result)
+
+
+FASTTEXT_TOPICS = {
+    "math": "integral derivative equation proof theorem matrix",
+    "cooking": "recipe salt pepper oven bake flour",
+    "sport": "football goal match team coach stadium",
+}
+
+
+def train_fasttext_model(model_path, **kwargs):
+    import fasttext
+
+    train_file = f"{model_path}.train"
+    with open(train_file, "w") as f:
+        for i in range(300):
+            for topic, words in FASTTEXT_TOPICS.items():
+                words = words.split()
+                f.write(f"__label__{topic} " + " ".join(words[(i + j) % len(words)] for j in range(4)) + "\n")
+    model = fasttext.train_supervised(train_file, epoch=20, dim=16, thread=1, seed=0, verbose=0, **kwargs)
+    model.save_model(model_path)
+    return model
+
+
+@require_fasttext
+class TestFastTextClassifierFilter(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def get_filter(self, **kwargs):
+        model_path = os.path.join(self.tmp_dir, "model.bin")
+        if not os.path.exists(model_path):
+            train_fasttext_model(model_path)
+        return FastTextClassifierFilter(model_path, **kwargs)
+
+    def test_document_mode(self):
+        keep_math = self.get_filter(keep_labels=("math", 0.5))
+        doc = Document("integral derivative proof theorem", id="0")
+        self.assertTrue(keep_math.filter(doc))
+        self.assertEqual(doc.text, "integral derivative proof theorem")
+        self.assertEqual(set(doc.metadata), {f"__label__{topic}" for topic in FASTTEXT_TOPICS})
+        self.assertGreater(doc.metadata["__label__math"], 0.5)
+        doc = Document("recipe salt oven bake", id="1")
+        self.assertFalse(keep_math.filter(doc))
+        self.assertEqual(doc.text, "")
+        self.assertLess(doc.metadata["__label__math"], 0.5)
+        self.assertEqual(keep_math.stats["kept_span"].total, 1)
+        self.assertEqual(keep_math.stats["removed_span"].total, 1)
+
+        remove_math = self.get_filter(remove_labels=[("math", 0.5)], save_labels_in_metadata=False)
+        doc = Document("integral derivative proof theorem", id="0")
+        self.assertFalse(remove_math.filter(doc))
+        self.assertEqual(doc.text, "")
+        self.assertEqual(doc.metadata, {})
+        doc = Document("recipe salt oven bake", id="1")
+        self.assertTrue(remove_math.filter(doc))
+        self.assertEqual(doc.text, "recipe salt oven bake")
+
+    def test_paragraph_mode(self):
+        text = "integral derivative proof theorem\n\nrecipe salt oven bake\n\nfootball goal team match"
+        keep_math = self.get_filter(keep_labels=("math", 0.5), filter_mode=SPLIT_TEXT_PARAGRAPHS)
+        doc = Document(text, id="0")
+        self.assertTrue(keep_math.filter(doc))
+        self.assertEqual(doc.text, "integral derivative proof theorem\n\n")
+        # mean over the 3 paragraphs of scores that sum to 1 for each paragraph
+        self.assertEqual(set(doc.metadata), {f"__label__{topic}" for topic in FASTTEXT_TOPICS})
+        self.assertAlmostEqual(sum(doc.metadata.values()), 1.0, places=4)
+        self.assertEqual(keep_math.stats["kept_span"].total, 1)
+        self.assertEqual(keep_math.stats["removed_span"].total, 2)
+
+        remove_labels = [("math", 0.5), ("sport", 0.5)]
+        remove_filter = self.get_filter(remove_labels=remove_labels, filter_mode=SPLIT_TEXT_PARAGRAPHS)
+        doc = Document(text, id="0")
+        self.assertTrue(remove_filter.filter(doc))
+        self.assertEqual(doc.text, "recipe salt oven bake\n\n")
+        doc = Document("integral derivative proof theorem\n\nfootball goal team match", id="1")
+        self.assertFalse(remove_filter.filter(doc))
+        self.assertEqual(doc.text, "")
+
+    @require_nltk
+    def test_sentence_mode(self):
+        keep_math = self.get_filter(keep_labels=("math", 0.5), filter_mode=SPLIT_TEXT_SENTENCES)
+        doc = Document("integral derivative proof theorem. recipe salt oven bake.", id="0")
+        self.assertTrue(keep_math.filter(doc))
+        self.assertEqual(doc.text.strip(), "integral derivative proof theorem.")
+        self.assertEqual(set(doc.metadata), {f"__label__{topic}" for topic in FASTTEXT_TOPICS})
+        self.assertEqual(keep_math.stats["kept_span"].total, 1)
+        self.assertEqual(keep_math.stats["removed_span"].total, 1)
+
+    def test_missing_labels(self):
+        # fastText can leave labels with very low scores out of a prediction: they never pass a threshold and are
+        # only averaged over the units where they were predicted
+        keep_math = self.get_filter(keep_labels=("math", 0.0))
+        math_column = keep_math.model.labels.index("__label__math")
+        scores = np.full((2, len(FASTTEXT_TOPICS)), np.nan, dtype=np.float32)
+        scores[1, math_column] = 0.5
+        self.assertEqual(keep_math.check_label_scores(scores).tolist(), [False, True])
+        self.assertEqual(keep_math.mean_label_scores(scores), {"__label__math": 0.5})
+
+    def test_quantize(self):
+        # word n-gram hash buckets make the input matrix large enough to be quantized
+        model_path = os.path.join(self.tmp_dir, "quantizable.bin")
+        train_fasttext_model(model_path, wordNgrams=2, bucket=1000)
+        fasttext_filter = FastTextClassifierFilter(model_path, keep_labels=("math", 0.5), quantize=True)
+        self.assertTrue(fasttext_filter.model.is_quantized())
+        self.assertTrue(fasttext_filter.filter(Document("integral derivative proof", id="0")))
+
+        # too small to be quantized: loaded as it is
+        model_path = os.path.join(self.tmp_dir, "small.bin")
+        train_fasttext_model(model_path)
+        fasttext_filter = FastTextClassifierFilter(model_path, keep_labels=("math", 0.5), quantize=True)
+        self.assertFalse(fasttext_filter.model.is_quantized())
+        self.assertTrue(fasttext_filter.filter(Document("integral derivative proof", id="0")))
+
+        # already quantized: loaded as it is
+        model_path = os.path.join(self.tmp_dir, "quantized.bin")
+        model = train_fasttext_model(model_path, wordNgrams=2, bucket=1000)
+        model.quantize(qnorm=True)
+        model.save_model(model_path)
+        fasttext_filter = FastTextClassifierFilter(model_path, keep_labels=("math", 0.5), quantize=True)
+        self.assertTrue(fasttext_filter.model.is_quantized())
+        self.assertTrue(fasttext_filter.filter(Document("integral derivative proof", id="0")))
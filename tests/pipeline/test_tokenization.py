@@ -8,6 +8,7 @@ import numpy as np
 
 from datatrove.data import Document
 from datatrove.io import DataFolder, get_datafolder
+from datatrove.pipeline.tokens.megatron_tokenizer import TokenizedFile
 from datatrove.pipeline.tokens.merger import DocumentTokenizerMerger
 from datatrove.pipeline.tokens.tokenizer import DocumentTokenizer
 from datatrove.tools.check_dataset import check_dataset, load_doc_ends
@@ -106,3 +107,49 @@ class TestTokenization(unittest.TestCase):
 
                 # check order/reconstruction
                 self.check_order_reconstruction(input_folder, merge_mapping)
+
+
+@require_tokenizers
+class TestTokenizedFile(unittest.TestCase):
+    def setUp(self):
+        # Create a temporary directory
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    def read_file(self, filename):
+        with open(os.path.join(self.tmp_dir, filename), "rb") as f:
+            return f.read()
+
+    def test_write_batch(self):
+        rng = np.random.default_rng(42)
+        for token_size in (2, 4):
+            with self.subTest(token_size=token_size):
+                max_id = np.iinfo(np.uint16 if token_size == 2 else np.uint32).max
+                docs = [rng.integers(0, max_id, size=rng.integers(0, 20), endpoint=True).tolist() for _ in range(30)]
+                docs[0] = [0, max_id]
+                indices = [3 * i for i in range(len(docs))]
+
+                single = TokenizedFile(self.tmp_dir, f"single_{token_size}.npy", token_size=token_size)
+                for tokens, index in zip(docs, indices):
+                    single.write(tokens, index)
+                single.close()
+
+                batched = TokenizedFile(self.tmp_dir, f"batched_{token_size}.npy", token_size=token_size)
+                batched.write_batch(docs[:10], indices[:10])
+                batched.write_batch(docs[10:], indices[10:])
+                batched.close()
+
+                self.assertEqual(batched.doc_ends, single.doc_ends)
+                self.assertEqual(batched.doc_indices, single.doc_indices)
+                for suffix in (".npy", ".idx"):
+                    self.assertEqual(
+                        self.read_file(f"batched_{token_size}{suffix}"), self.read_file(f"single_{token_size}{suffix}")
+                    )
+
+    def test_write_batch_out_of_range(self):
+        for token_size, tokens in ((2, [1, 70000]), (2, [-1]), (4, [2**32])):
+            with self.subTest(token_size=token_size, tokens=tokens):
+                tokenized_file = TokenizedFile(self.tmp_dir, f"out_of_range_{token_size}.npy", token_size=token_size)
+                with self.assertRaises(ValueError):
+                    tokenized_file.write_batch([[5], tokens], [0, 1])
+                tokenized_file.close()